@@ -0,0 +1,133 @@
+"""Benchmarks for the Music Wrapped app. Both need a populated database and database.ini.
+
+memory:  memory footprint of the DataFrame returned by each DBIO method, compared with the frames
+         the old tuple-based construction produced (object strings, int64 counts).
+startup: import time of project.py and time to the first full render, each in a fresh interpreter;
+         exits non-zero when a run exceeds the given budgets so startup regressions are caught.
+
+    python benchmark.py memory
+    python benchmark.py startup --max-import-s 2 --max-render-s 5
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+
+import pandas as pd
+
+IMPORT_SNIPPET = """
+import time
+start = time.perf_counter()
+import project
+print(time.perf_counter() - start)
+"""
+
+# AppTest ships with streamlit >= 1.28; older releases only get the import measurement
+NO_APPTEST_EXIT_CODE = 3
+RENDER_SNIPPET = f"""
+import sys
+import time
+try:
+    from streamlit.testing.v1 import AppTest
+except ImportError:
+    sys.exit({NO_APPTEST_EXIT_CODE})
+start = time.perf_counter()
+at = AppTest.from_file("project.py", default_timeout=60).run()
+elapsed = time.perf_counter() - start
+# AppTest records exceptions raised by the script instead of raising them
+if at.exception:
+    print(at.exception[0].value, file=sys.stderr)
+    sys.exit(1)
+print(elapsed)
+"""
+
+
+def legacy_frame(df: pd.DataFrame) -> pd.DataFrame:
+    # what pd.DataFrame(data=<list of tuples>, columns=...) used to give us
+    rows = [tuple(v.item() if hasattr(v, "item") else v for v in row) for row in df.astype(object).values]
+    return pd.DataFrame(data=rows, columns=df.columns)
+
+
+def memory_benchmark():
+    from project import DBIO
+
+    users_df = DBIO.get_users(most_active=True)
+    user, dob = users_df["name"][0], int(users_df["dob"][0])
+    songs_df = DBIO.get_songs(most_played=True)
+    song, release = songs_df["song"][0], int(songs_df["release"][0])
+    genre = DBIO.get_genres()["genre"][0]
+
+    calls = {
+        "get_users": lambda: DBIO.get_users(most_active=False),
+        "get_recently_played_songs_by_user": lambda: DBIO.get_recently_played_songs_by_user(user=user, dob=dob),
+        "get_most_played_songs_by_user": lambda: DBIO.get_most_played_songs_by_user(user=user, dob=dob),
+        "get_most_played_genres_by_user": lambda: DBIO.get_most_played_genres_by_user(user=user, dob=dob),
+        "get_recommended_songs_for_user": lambda: DBIO.get_recommended_songs_for_user(user=user, dob=dob),
+        "get_songs": lambda: DBIO.get_songs(most_played=False),
+        "get_top_listeners_of_song": lambda: DBIO.get_top_listeners_of_song(song=song, release=release),
+        "get_songs_with_common_listeners": lambda: DBIO.get_songs_with_common_listeners(song=song, release=release),
+        "get_artists_with_most_song_releases": lambda: DBIO.get_artists_with_most_song_releases(1991, 2021, "no"),
+        "get_artists_with_most_album_releases": lambda: DBIO.get_artists_with_most_album_releases(1991, 2021, "no"),
+        "get_artists_in_bands": lambda: DBIO.get_artists_in_bands(),
+        "get_bands": lambda: DBIO.get_bands(most_albums=False),
+        "get_genres": lambda: DBIO.get_genres(),
+        "get_bands_with_most_song_plays": lambda: DBIO.get_bands_with_most_song_plays(year=2019, genre=genre),
+        "get_band_plays_by_genre_and_year":
+            lambda: DBIO.get_band_plays_by_genre_and_year(genres=(genre,), years=(2018, 2019, 2020)),
+        "get_albums_most_featured_in_user_libraries":
+            lambda: DBIO.get_albums_most_featured_in_user_libraries(year=2018, genre=genre),
+    }
+
+    print(f"{'method':<45}{'rows':>8}{'legacy bytes':>15}{'typed bytes':>15}{'ratio':>8}")
+    for name, call in calls.items():
+        typed = call()
+        legacy = legacy_frame(typed)
+        typed_bytes = typed.memory_usage(deep=True).sum()
+        legacy_bytes = legacy.memory_usage(deep=True).sum()
+        print(f"{name:<45}{len(typed):>8}{legacy_bytes:>15}{typed_bytes:>15}{legacy_bytes / typed_bytes:>8.2f}")
+
+
+def time_in_fresh_interpreter(snippet: str, runs: int) -> list:
+    timings = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", snippet], capture_output=True, text=True, check=True)
+        timings.append(float(out.stdout.strip().splitlines()[-1]))
+    return timings
+
+
+def startup_benchmark(runs: int, max_import_s: float, max_render_s: float) -> bool:
+    ok = True
+    checks = [("import", IMPORT_SNIPPET, max_import_s), ("first render", RENDER_SNIPPET, max_render_s)]
+    for name, snippet, budget in checks:
+        try:
+            timings = time_in_fresh_interpreter(snippet, runs)
+        except subprocess.CalledProcessError as e:
+            if e.returncode == NO_APPTEST_EXIT_CODE:
+                print(f"{name:<15}skipped: streamlit.testing.v1.AppTest is not available")
+                continue
+            # a startup that crashes is the worst regression of all
+            print(f"{name:<15}FAILED: {e.stderr.strip().splitlines()[-1] if e.stderr else e}")
+            ok = False
+            continue
+
+        median = statistics.median(timings)
+        print(f"{name:<15}median {median:.3f}s  min {min(timings):.3f}s  max {max(timings):.3f}s  "
+              f"budget {budget if budget else '-'}")
+        if budget and median > budget:
+            print(f"{name:<15}REGRESSION: median {median:.3f}s exceeds budget {budget}s")
+            ok = False
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("benchmark", choices=["memory", "startup"])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-import-s", type=float, default=None)
+    parser.add_argument("--max-render-s", type=float, default=None)
+    args = parser.parse_args()
+
+    if args.benchmark == "memory":
+        memory_benchmark()
+    elif not startup_benchmark(args.runs, args.max_import_s, args.max_render_s):
+        sys.exit(1)
@@ -0,0 +1,226 @@
+"""Process-wide database state for project.py.
+
+Streamlit re-executes project.py on every rerun, but modules it imports stay in sys.modules, so
+everything built here (settings, admission control, connection pools, the psycopg2 wait callback)
+exists once per worker process and is shared by every session. None of it lives in st.cache, so
+clearing the cache does not rebuild it.
+"""
+import atexit
+import logging
+import os
+import threading
+import types
+from configparser import ConfigParser
+from dataclasses import dataclass
+from select import select
+from types import MappingProxyType
+from typing import Mapping, Optional
+
+import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
+
+# third-party libraries stay at WARNING; our own level comes from database.ini
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger("music_wrapped")
+
+# the helper moved between streamlit releases; either way it returns None outside a script run
+try:
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+except ImportError:
+    try:
+        from streamlit.scriptrunner import get_script_run_ctx
+    except ImportError:
+        from streamlit.report_thread import get_report_ctx as get_script_run_ctx
+
+# seconds between checks for a rerun/disconnect while a query runs
+CancelCheckInterval = 0.1
+
+
+class QueryRejected(Exception):
+    """A query was shed, cancelled or failed; the message is meant for the user. project.run()
+    shows it after `marker`, which tells it apart from the app's other st.error messages."""
+
+    marker = "Database: "
+
+
+@dataclass(frozen=True)
+class Settings:
+    db: Mapping[str, str]
+    replica: Optional[Mapping[str, str]]
+    log_level: str = "WARNING"
+    pool_min_connections: int = 1
+    admission_capacity: int = 8
+
+    @staticmethod
+    def load(filename: str = "database.ini") -> "Settings":
+        parser = ConfigParser()
+        parser.read(filename)
+
+        def section(name):
+            return MappingProxyType(dict(parser.items(name))) if parser.has_section(name) else None
+
+        app = parser["app"] if parser.has_section("app") else {}
+        return Settings(
+            db=section("postgresql"),
+            replica=section("postgresql_replica"),
+            log_level=app.get("log_level", Settings.log_level).upper(),
+            pool_min_connections=int(app.get("pool_min_connections", Settings.pool_min_connections)),
+            admission_capacity=int(app.get("admission_capacity", Settings.admission_capacity)),
+        )
+
+
+class WeightedSemaphore:
+    """Admission control: a query of weight w may run only while the total weight of running
+    queries stays within capacity; otherwise it queues for up to `timeout` seconds."""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.in_use = 0
+        self.__cond = threading.Condition()
+
+    def acquire(self, weight: int, timeout: float) -> bool:
+        weight = min(weight, self.capacity)
+        with self.__cond:
+            if not self.__cond.wait_for(lambda: self.in_use + weight <= self.capacity, timeout=timeout):
+                return False
+            self.in_use += weight
+            return True
+
+    def release(self, weight: int):
+        weight = min(weight, self.capacity)
+        with self.__cond:
+            self.in_use -= weight
+            self.__cond.notify_all()
+
+
+def _run_interrupted(ctx) -> bool:
+    # a pending rerun (widget change) or stop (session disconnected) means nobody will see the result
+    requests = getattr(ctx, "script_requests", None)
+    state = getattr(requests, "_state", None)
+    if state is None:
+        return False
+    return getattr(state, "name", "CONTINUE") != "CONTINUE"
+
+
+class InterruptFlag(threading.local):
+    """Set by the wait callback when it cancelled the thread's query because its script run went
+    away, so the caller can tell that apart from a statement_timeout."""
+    cancelled = False
+
+
+_interrupt = InterruptFlag()
+
+
+def clear_interrupted():
+    _interrupt.cancelled = False
+
+
+def was_interrupted() -> bool:
+    return _interrupt.cancelled
+
+
+def _wait_interruptible(conn):
+    """psycopg2 wait callback: poll the connection and cancel the running statement when the
+    Streamlit run that issued it is rerun or its session goes away."""
+    ctx = get_script_run_ctx()
+    while True:
+        state = conn.poll()
+        if state == psycopg2.extensions.POLL_OK:
+            break
+        elif state == psycopg2.extensions.POLL_READ:
+            select([conn.fileno()], [], [], CancelCheckInterval)
+        elif state == psycopg2.extensions.POLL_WRITE:
+            select([], [conn.fileno()], [], CancelCheckInterval)
+        else:
+            raise psycopg2.OperationalError(f"bad state from poll: {state}")
+
+        # cancel once per query: the ROLLBACK that follows runs in the same interrupted script run,
+        # and a second cancel could hit whatever the connection runs after it
+        if not _interrupt.cancelled and _run_interrupted(ctx):
+            logger.info("db_runtime :: wait : script run interrupted, cancelling query")
+            _interrupt.cancelled = True
+            conn.cancel()
+
+
+psycopg2.extensions.set_wait_callback(_wait_interruptible)
+
+SETTINGS = Settings.load(os.environ.get("MUSIC_WRAPPED_CONFIG", "database.ini"))
+logger.setLevel(SETTINGS.log_level)
+
+ADMISSION = WeightedSemaphore(SETTINGS.admission_capacity)
+
+
+class ConnectionPools:
+    """The primary pool and, when database.ini has [postgresql_replica], the replica pool.
+
+    A database that is unreachable at startup must not break importing project.py; its pool is
+    left unbuilt and retried on first use, and queries fail with QueryRejected meanwhile."""
+
+    def __init__(self, settings: Settings):
+        self.__db = dict(settings.db) if settings.db else None
+        self.__replica_db = dict(settings.replica) if settings.replica else None
+        self.__min_connections = settings.pool_min_connections
+        # every running query holds admission weight >= 1, so capacity connections are always enough
+        self.__max_connections = settings.admission_capacity
+        self.__lock = threading.Lock()
+        self.primary = self.__connect(self.__db)
+        self.replica = self.__connect(self.__replica_db)
+
+    def __connect(self, db_info):
+        if db_info is None:
+            return None
+        try:
+            return psycopg2.pool.ThreadedConnectionPool(self.__min_connections, self.__max_connections,
+                                                        **db_info)
+        except psycopg2.OperationalError as e:
+            logger.warning(f"ConnectionPools :: connect : database unavailable: {e}")
+            return None
+
+    def get(self, read_only: bool):
+        # read-only classes go to the replica when one is configured and reachable
+        with self.__lock:
+            if read_only and self.__replica_db:
+                if self.replica is None:
+                    self.replica = self.__connect(self.__replica_db)
+                if self.replica is not None:
+                    return self.replica
+
+            if self.primary is None:
+                if self.__db is None:
+                    raise QueryRejected("No database configured: add a [postgresql] section to database.ini.")
+                self.primary = self.__connect(self.__db)
+            if self.primary is None:
+                raise QueryRejected("The database is unavailable right now, please try again later.")
+            return self.primary
+
+    def pools(self) -> list:
+        return [pool for pool in (self.primary, self.replica) if pool is not None]
+
+    def close(self):
+        for pool in self.pools():
+            if not pool.closed:
+                pool.closeall()
+
+
+# Streamlit's file watcher re-imports this module when it is edited; the pools of the previous
+# import are parked on psycopg2.pool, which outlives us, and closed before opening new ones
+_previous_pools = getattr(psycopg2.pool, "_music_wrapped_pools", None)
+if hasattr(_previous_pools, "close"):
+    _previous_pools.close()
+
+POOLS = ConnectionPools(SETTINGS)
+psycopg2.pool._music_wrapped_pools = POOLS
+atexit.register(POOLS.close)
+
+# The legacy st.cache hashes the globals its functions reach, following DBIO methods into
+# DBHelper.query_db and from there into the objects above, which hold locks it cannot hash.
+# They are process-wide singletons, so their identity is all a cache key needs. Bound methods
+# (ADMISSION.acquire, ...) are a new object on every access and would otherwise be hashed with
+# their instance's attributes, so only the code behind them counts.
+RUNTIME_HASH_FUNCS = {
+    WeightedSemaphore: id,
+    InterruptFlag: id,
+    ConnectionPools: id,
+    types.MethodType: lambda method: method.__func__,
+}
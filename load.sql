@@ -10654,3 +10654,6 @@ INSERT INTO Users_Libraries(uname,udob,lib_name,sname,srelease_date,since) VALUE
 INSERT INTO Users_Libraries(uname,udob,lib_name,sname,srelease_date,since) VALUES('Jacob Bailey',19960729,'Jacob Bailey Spotlight','Hey There Delilah',2005,20210748);
 INSERT INTO Users_Libraries(uname,udob,lib_name,sname,srelease_date,since) VALUES('Thomas Lewis',19960730,'Thomas Lewis Spotlight','Let It Burn',2011,20210749);
 
+-- Bands_Create_Songs is loaded after Song_Plays, so the cube triggers missed the band side of
+-- every play; rebuild both cubes now that every table is populated
+select refresh_music_cubes();
@@ -0,0 +1,399 @@
+"""Load generator for the Music Wrapped app: N concurrent sessions walking the five areas.
+
+dbio:     each session is a thread making the same DBIO calls a page view of run() makes, with the
+          same choices a user has (users, spotlights, year/genre/month, ...). Reports per page.
+apptest:  each session drives project.py through streamlit's headless AppTest client
+          (streamlit >= 1.28), changing one widget per rerun. Reports per area. AppTest swaps
+          process-wide streamlit state (the Runtime instance, config options) on every run, so
+          each session gets a process of its own and reports its stats back when done.
+
+Both need a populated database and database.ini. While sessions run, a sampler records pool
+connections in use, server backends (pg_stat_activity) and the memory of the worker processes.
+
+    python loadtest.py dbio --sessions 20 --duration 60
+    python loadtest.py apptest --sessions 5 --duration 60 --cold
+"""
+import argparse
+import multiprocessing
+import random
+import threading
+import time
+from collections import Counter, defaultdict
+
+import psycopg2
+import psycopg2.pool
+import streamlit as st
+
+import db_runtime
+from db_runtime import QueryRejected
+from project import DBIO
+
+try:
+    from streamlit.runtime.scriptrunner import StopException
+except ImportError:
+    from streamlit.runtime.scriptrunner.exceptions import StopException
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+    import resource
+
+
+class Stats:
+    """Thread-safe page view latencies, per-view query counts and errors by type."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.queries = defaultdict(int)
+        self.errors = defaultdict(int)
+        self.error_types = Counter()
+        self.__lock = threading.Lock()
+
+    def record(self, page: str, seconds: float, queries: int):
+        with self.__lock:
+            self.latencies[page].append(seconds)
+            self.queries[page] += queries
+
+    def record_error(self, page: str, error_type: str):
+        with self.__lock:
+            self.errors[page] += 1
+            self.error_types[error_type] += 1
+
+    def snapshot(self) -> tuple:
+        # plain containers, to send the stats of an apptest process back to the parent
+        with self.__lock:
+            return dict(self.latencies), dict(self.queries), dict(self.errors), dict(self.error_types)
+
+    def merge(self, snapshot: tuple):
+        latencies, queries, errors, error_types = snapshot
+        with self.__lock:
+            for page, seconds in latencies.items():
+                self.latencies[page].extend(seconds)
+            for page, n in queries.items():
+                self.queries[page] += n
+            for page, n in errors.items():
+                self.errors[page] += n
+            self.error_types.update(error_types)
+
+
+class QueryCounter:
+    """Counts queries that reach the database: each one borrows a pooled connection, so getconn
+    calls are counted (st.cache hits never get that far). Totals are kept per worker and per
+    thread, the latter giving the queries a dbio page view caused."""
+
+    def __init__(self):
+        self.total = 0
+        self.__local = threading.local()
+        self.__lock = threading.Lock()
+
+    def wrap(self, pool_class):
+        getconn = pool_class.getconn
+
+        def counting_getconn(*args, **kwargs):
+            with self.__lock:
+                self.total += 1
+            self.__local.n = self.thread_count() + 1
+            return getconn(*args, **kwargs)
+
+        pool_class.getconn = counting_getconn
+
+    def thread_count(self) -> int:
+        return getattr(self.__local, "n", 0)
+
+    def reset_thread_count(self):
+        self.__local.n = 0
+
+
+query_counter = QueryCounter()
+
+
+def clear_st_cache():
+    # the legacy cache moved between streamlit releases
+    caching = getattr(st, "legacy_caching", None) or getattr(st, "caching", None)
+    caching.clear_cache()
+
+
+def pool_connections_in_use() -> int:
+    return sum(len(pool._used) for pool in db_runtime.POOLS.pools())
+
+
+def rss_mb() -> float:
+    if psutil is not None:
+        # this process plus the apptest session processes, if any
+        rss = 0
+        this = psutil.Process()
+        for process in [this] + this.children():
+            try:
+                rss += process.memory_info().rss
+            except psutil.NoSuchProcess:
+                pass
+        return rss / 2 ** 20
+    # without psutil only the peak of this process is available (KiB on linux); exited children
+    # are not counted
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10
+
+
+def sample(samples: list, stop: threading.Event, interval: float, started: float, pool_in_use):
+    conn = psycopg2.connect(**db_runtime.SETTINGS.db)
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            while not stop.wait(interval):
+                cur.execute("SELECT COUNT(*) FROM pg_stat_activity WHERE datname = current_database()")
+                backends = cur.fetchone()[0] - 1  # minus the sampler itself
+                samples.append((time.perf_counter() - started, pool_in_use(), backends, rss_mb()))
+    finally:
+        conn.close()
+
+
+# =================================================================================================
+# dbio mode: one function per page, mirroring what run() calls for that page
+# =================================================================================================
+YEARS = [1991 + i for i in range(31)]
+
+
+def view_users(rnd: random.Random):
+    users_df = DBIO.get_users(most_active=rnd.random() < 0.5)
+    i = rnd.randrange(users_df.shape[0])
+    user, dob = users_df["name"][i], int(users_df["dob"][i])
+    spotlight = rnd.choice([DBIO.get_recently_played_songs_by_user, DBIO.get_most_played_songs_by_user,
+                            DBIO.get_most_played_genres_by_user, DBIO.get_recommended_songs_for_user])
+    spotlight(user=user, dob=dob)
+
+
+def view_songs(rnd: random.Random):
+    songs_df = DBIO.get_songs(most_played=rnd.random() < 0.5)
+    i = rnd.randrange(songs_df.shape[0])
+    song, release = songs_df["song"][i], int(songs_df["release"][i])
+    spotlight = rnd.choice([DBIO.get_top_listeners_of_song, DBIO.get_songs_with_common_listeners])
+    spotlight(song=song, release=release)
+
+
+def view_artists(rnd: random.Random):
+    DBIO.get_artists_in_bands()
+    st_year, end_year = sorted(rnd.sample(YEARS, 2))
+    award_won = rnd.choice(["yes", "no"])
+    DBIO.get_artists_with_most_song_releases(start_year=st_year, end_year=end_year, award_won=award_won)
+    DBIO.get_artists_with_most_album_releases(start_year=st_year, end_year=end_year, award_won=award_won)
+
+
+def view_bands(rnd: random.Random):
+    DBIO.get_bands(most_albums=rnd.random() < 0.5)
+    genres_list = DBIO.get_genres()["genre"].tolist()
+    genre = rnd.choice(genres_list)
+    year = rnd.choice([2017, 2018, 2019, 2020])
+    month = rnd.choice([None] + [i + 1 for i in range(12)])
+    DBIO.get_bands_with_most_song_plays(year=year, genre=genre, month=month)
+    cmp_genres = rnd.sample(genres_list, rnd.randint(1, min(3, len(genres_list))))
+    cmp_years = rnd.sample([2017, 2018, 2019, 2020], rnd.randint(1, 4))
+    DBIO.get_band_plays_by_genre_and_year(genres=tuple(cmp_genres), years=tuple(cmp_years))
+
+
+def view_albums(rnd: random.Random):
+    genre = rnd.choice(DBIO.get_genres()["genre"].tolist())
+    year = rnd.choice([2018, 2019, 2020, 2021])
+    DBIO.get_albums_most_featured_in_user_libraries(genre=genre, year=year)
+
+
+PAGES = {
+    DBIO.Users: view_users,
+    DBIO.Songs: view_songs,
+    DBIO.Artists: view_artists,
+    DBIO.Bands: view_bands,
+    DBIO.Albums: view_albums,
+}
+
+
+def dbio_session(seed: int, deadline: float, args, stats: Stats):
+    rnd = random.Random(seed)
+    while time.perf_counter() < deadline:
+        page = rnd.choice(list(PAGES))
+        if args.cold:
+            clear_st_cache()
+
+        query_counter.reset_thread_count()
+        start = time.perf_counter()
+        try:
+            PAGES[page](rnd)
+        except (Exception, StopException) as e:
+            # QueryRejected is the app shedding or cancelling work; anything else is worth a look
+            stats.record_error(page, type(e).__name__)
+        else:
+            stats.record(page, time.perf_counter() - start, query_counter.thread_count())
+        time.sleep(rnd.uniform(0, args.think_time))
+
+
+# =================================================================================================
+# apptest mode: headless script runs of project.py
+# =================================================================================================
+def apptest_session(seed: int, deadline: float, args, stats: Stats):
+    from streamlit.testing.v1 import AppTest
+
+    rnd = random.Random(seed)
+    at = AppTest.from_file("project.py", default_timeout=args.timeout)
+    at.run()
+    while time.perf_counter() < deadline:
+        area_box = at.selectbox[0]
+        # pick a user/song, open a spotlight, change year/genre/... on the current area, and now and
+        # then move to another area
+        widgets = [w for w in list(at.selectbox)[1:] if w.options] + list(at.checkbox)
+        widget = area_box if not widgets or rnd.random() < 0.3 else rnd.choice(widgets)
+
+        if hasattr(widget, "options"):
+            widget.select_index(rnd.randrange(len(widget.options)))
+        else:
+            widget.set_value(not widget.value)
+
+        if args.cold:
+            clear_st_cache()
+
+        page = area_box.value
+        start = time.perf_counter()
+        try:
+            at.run()
+            # uncaught exceptions in project.py, and the QueryRejected messages run() shows with st.error;
+            # other st.error messages (e.g. an invalid year range) are part of a normal page view
+            if len(at.exception):
+                error_type = "script exception"
+            elif any(error.value.startswith(QueryRejected.marker) for error in at.error):
+                error_type = "QueryRejected"
+            else:
+                error_type = None
+        except Exception as e:
+            error_type = type(e).__name__
+        if error_type:
+            stats.record_error(page, error_type)
+        else:
+            # the script thread is not ours, so queries are only totalled over all sessions
+            stats.record(page, time.perf_counter() - start, 0)
+        time.sleep(rnd.uniform(0, args.think_time))
+
+
+def apptest_process(seed: int, duration: float, args, results, pool_in_use):
+    """One apptest session in a process of its own: publishes its pool connections in use while it
+    runs, then sends back its stats and query total."""
+    query_counter.wrap(psycopg2.pool.ThreadedConnectionPool)
+    stats, stop = Stats(), threading.Event()
+
+    def publish_pool_in_use():
+        while not stop.wait(args.sample_interval / 2):
+            pool_in_use.value = pool_connections_in_use()
+
+    publisher = threading.Thread(target=publish_pool_in_use, daemon=True)
+    publisher.start()
+    try:
+        # perf_counter is not comparable across processes, so the deadline is taken here
+        apptest_session(seed, time.perf_counter() + duration, args, stats)
+    except Exception as e:
+        stats.record_error("-", type(e).__name__)
+    finally:
+        stop.set()
+        pool_in_use.value = 0
+        results.put((stats.snapshot(), query_counter.total))
+
+
+def run_apptest_sessions(args, stats: Stats, pool_in_use: list) -> int:
+    # spawn rather than fork: the parent already has pools with open connections
+    mp = multiprocessing.get_context("spawn")
+    results = mp.Queue()
+    processes = [mp.Process(target=apptest_process,
+                            args=(args.seed + i, args.duration, args, results, in_use))
+                 for i, in_use in enumerate(pool_in_use)]
+    for p in processes:
+        p.start()
+
+    total_queries = 0
+    # drain the queue before joining, or a process blocks on flushing its result
+    for _ in processes:
+        snapshot, queries = results.get()
+        stats.merge(snapshot)
+        total_queries += queries
+    for p in processes:
+        p.join()
+    return total_queries
+
+
+# =================================================================================================
+# report
+# =================================================================================================
+def percentile(values: list, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def report(stats: Stats, samples: list, total_queries: int, elapsed: float, mode: str):
+    views = sum(len(v) for v in stats.latencies.values())
+    print(f"\n{views} page views in {elapsed:.1f}s ({views / elapsed:.1f}/s), "
+          f"{total_queries} queries ({total_queries / max(views, 1):.2f}/view)\n")
+
+    print(f"{'page':<10}{'views':>8}{'errors':>8}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}"
+          f"{'queries/view':>14}")
+    for page in sorted(set(stats.latencies) | set(stats.errors)):
+        latencies = [s * 1000 for s in stats.latencies[page]] or [float("nan")]
+        n = len(stats.latencies[page])
+        per_view = f"{stats.queries[page] / max(n, 1):.2f}" if mode == "dbio" else "-"
+        print(f"{page:<10}{n:>8}{stats.errors[page]:>8}{percentile(latencies, 50):>10.1f}"
+              f"{percentile(latencies, 90):>10.1f}{percentile(latencies, 99):>10.1f}{max(latencies):>10.1f}"
+              f"{per_view:>14}")
+
+    if stats.error_types:
+        print("\nerrors by type:")
+        for error_type, count in stats.error_types.most_common():
+            print(f"{count:>8}  {error_type}")
+
+    memory_label = "rss MB" if psutil is not None else "peak rss MB"
+    print(f"\n{'t s':>8}{'pool conns':>12}{'backends':>10}{memory_label:>14}")
+    for t, in_use, backends, memory in samples:
+        print(f"{t:>8.1f}{in_use:>12}{backends:>10}{memory:>14.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("mode", choices=["dbio", "apptest"])
+    parser.add_argument("--sessions", type=int, default=10)
+    parser.add_argument("--duration", type=float, default=30, help="seconds each session keeps walking")
+    parser.add_argument("--think-time", type=float, default=1.0, help="max seconds between page views")
+    parser.add_argument("--cold", action="store_true", help="clear the st.cache before every page view")
+    parser.add_argument("--sample-interval", type=float, default=1.0)
+    parser.add_argument("--timeout", type=float, default=60, help="apptest: seconds allowed per rerun")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    stats, samples, stop = Stats(), [], threading.Event()
+    started = time.perf_counter()
+
+    if args.mode == "dbio":
+        # the pools live in db_runtime, which is imported once per process and shared by all the
+        # session threads. They may only be built on first use, so the pool class is wrapped
+        query_counter.wrap(psycopg2.pool.ThreadedConnectionPool)
+        pool_in_use_total = pool_connections_in_use
+    else:
+        # each apptest process has its own pools and publishes how many connections it uses
+        pool_in_use = [multiprocessing.get_context("spawn").Value("i", 0) for _ in range(args.sessions)]
+
+        def pool_in_use_total():
+            return sum(in_use.value for in_use in pool_in_use)
+
+    sampler = threading.Thread(target=sample, daemon=True,
+                               args=(samples, stop, args.sample_interval, started, pool_in_use_total))
+    sampler.start()
+    if args.mode == "dbio":
+        deadline = started + args.duration
+        threads = [threading.Thread(target=dbio_session, args=(args.seed + i, deadline, args, stats))
+                   for i in range(args.sessions)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        total_queries = query_counter.total
+    else:
+        total_queries = run_apptest_sessions(args, stats, pool_in_use)
+    stop.set()
+    sampler.join()
+
+    report(stats, samples, total_queries, time.perf_counter() - started, args.mode)
+
+
+if __name__ == "__main__":
+    main()
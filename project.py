@@ -1,67 +1,122 @@
 import logging
-from configparser import ConfigParser
 
 import pandas as pd
 import psycopg2
+import psycopg2.extensions
 import streamlit as st
 
-logging.basicConfig(level=logging.DEBUG)
+from db_runtime import (ADMISSION, POOLS, RUNTIME_HASH_FUNCS, QueryRejected, clear_interrupted, logger,
+                        was_interrupted)
 
 
 class DBHelper:
+    # query classes: (statement timeout in ms, admission weight, max seconds queued before shedding,
+    # may be served by the replica)
+    QueryClasses = {
+        "lookup": (2000, 1, 5.0, False),
+        "analytics": (10000, 2, 5.0, True),
+        "heavy": (15000, 4, 1.0, True),
+    }
+
+    # postgres type oids of the columns our queries return: int8 (COUNT(*)), int2, int4 / text, varchar
+    IntTypeCodes = {20, 21, 23}
+    StringTypeCodes = {25, 1043}
+    # string columns with at most this share of distinct values are stored as categoricals
+    CategoryMaxUniqueRatio = 0.5
+    # store the remaining strings as Arrow-backed "string[pyarrow]" instead of python objects
+    UseArrowStrings = False
 
     @staticmethod
-    @st.cache
-    def __get_config(filename: str = "database.ini", section: str = "postgresql"):
-        logging.info("DBHelper :: get_config() : start")
-        logging.debug(f"filename: {filename}, section: {section}")
-        
-        parser = ConfigParser()
-        parser.read(filename)
-        configs = {k: v for k, v in parser.items(section)}
-            
-        logging.debug(f"configs: {configs}")
-        logging.info("DBHelper :: get_config() : end")
-        return configs
-
-    @staticmethod
-    @st.cache
-    def query_db(sql: str):
-        logging.info("DBHelper :: query_db() : start")
-        logging.debug(f"sql: {sql}")
-
-        db_info = DBHelper.__get_config()
+    @st.cache(hash_funcs=RUNTIME_HASH_FUNCS)
+    def query_db(sql: str, query_class: str = "analytics", params=None):
+        logger.info("DBHelper :: query_db() : start")
+        logger.debug(f"sql: {sql}")
+        logger.debug(f"params: {params}")
+        logger.debug(f"query_class: {query_class}")
+
+        timeout_ms, weight, max_wait, read_only = DBHelper.QueryClasses[query_class]
+        # read-only classes go to [postgresql_replica] when database.ini defines one
+        pool = POOLS.get(read_only)
+
+        if not ADMISSION.acquire(weight, timeout=max_wait):
+            logger.warning(f"DBHelper :: query_db() : shed '{query_class}' query, server busy")
+            raise QueryRejected("The server is busy right now, please try again in a moment.")
+
+        conn = None
+        broken = False
         try:
-            # Connect to an existing database
-            conn = psycopg2.connect(**db_info)
+            # Borrow a connection from the pool
+            conn = pool.getconn()
+            conn.set_session(readonly=read_only)
+            clear_interrupted()
 
             # Open a cursor to perform database operations
-            cur = conn.cursor()
-
-            # Execute a command
-            cur.execute(sql)
-        except Exception as e:
-            st.write(e)
-
-        # Obtain data
-        data = cur.fetchall()
-        logging.debug(f"data: {data}")
-
-        column_names = [desc[0] for desc in cur.description]
-        logging.debug(f"columns_names: {column_names}")
-
-        # Make the changes to the database persistent
-        conn.commit()
-
-        # Close communication with the database
-        cur.close()
-        conn.close()
+            with conn.cursor() as cur:
+                # Enforce the query class's time budget on the server
+                cur.execute("SET LOCAL statement_timeout = %s", (timeout_ms,))
+
+                # Execute a command
+                cur.execute(sql, params)
+
+                # Obtain data
+                data = cur.fetchall()
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(f"data: {data}")
+
+                description = cur.description
+                logger.debug(f"columns_names: {[desc[0] for desc in description]}")
+
+            # End the transaction so the connection goes back to the pool idle
+            conn.commit()
+        except psycopg2.extensions.QueryCanceledError as e:
+            logger.warning(f"DBHelper :: query_db() : cancelled: {e}")
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                logger.exception("DBHelper :: query_db() : rollback after cancel failed")
+                broken = True
+            if was_interrupted():
+                raise QueryRejected("The query was cancelled because the page was rerun or closed.") from e
+            raise QueryRejected(f"The query took longer than its {timeout_ms / 1000:g}s budget "
+                                f"and was cancelled.") from e
+        except psycopg2.Error as e:
+            logger.exception("DBHelper :: query_db() : failed")
+            broken = True
+            raise QueryRejected(f"The query failed: {e}") from e
+        finally:
+            # Return the connection; failed ones are closed rather than reused
+            if conn is not None:
+                pool.putconn(conn, close=broken)
+            ADMISSION.release(weight)
+
+        df = DBHelper.build_frame(data=data, description=description)
+        logger.debug(f"df.shape: {df.shape}")
+        logger.debug(f"df.dtypes: {df.dtypes.to_dict()}")
+
+        logger.info("DBHelper :: query_db() : end")
+        return df
 
-        df = pd.DataFrame(data=data, columns=column_names)
-        logging.debug(f"df.shape: {df.shape}")
+    @staticmethod
+    def build_frame(data: list, description) -> pd.DataFrame:
+        """Build the result DataFrame column by column, in compact dtypes: downcast integers,
+        categoricals for low-cardinality strings (genre, band, ...) and optionally Arrow strings."""
+        columns = list(zip(*data)) if data else [()] * len(description)
+
+        frame = {}
+        for desc, values in zip(description, columns):
+            if desc.type_code in DBHelper.IntTypeCodes:
+                # columns holding NULLs stay float, everything else shrinks to the smallest int type
+                col = pd.to_numeric(pd.Series(values, dtype=None if None in values else "int64"),
+                                    downcast="integer")
+            elif desc.type_code in DBHelper.StringTypeCodes:
+                col = pd.Series(values, dtype="string[pyarrow]" if DBHelper.UseArrowStrings else object)
+                if len(col) and col.nunique() <= DBHelper.CategoryMaxUniqueRatio * len(col):
+                    col = col.astype("category")
+            else:
+                col = pd.Series(values, dtype=None if values else object)
+            frame[desc[0]] = col
 
-        logging.info("DBHelper :: query_db() : end")
-        return df
+        return pd.DataFrame(frame, columns=[desc[0] for desc in description])
 
 
 class DBIO:
@@ -79,11 +134,13 @@ class DBIO:
     UserLibraries = "Users_Libraries"
     ArtistsWinAwards = "Artists_Win_Awards"
     ArtistsFormBands = "Artists_Form_Bands"
+    BandPlaysCube = "Band_Plays_Cube"
+    AlbumAddsCube = "Album_Adds_Cube"
 
     @staticmethod
-    @st.cache
+    @st.cache(hash_funcs=RUNTIME_HASH_FUNCS)
     def get_users(most_active: bool) -> pd.DataFrame:
-        logging.info("DBIO :: get_users : start")
+        logger.info("DBIO :: get_users : start")
 
         if most_active:
             sql = f"""
@@ -104,22 +161,22 @@ class DBIO:
                 GROUP BY name, dob
                 ORDER BY name;
             """
-        logging.debug(sql)
+        logger.debug(sql)
 
         df = DBHelper.query_db(sql=sql)
 
-        logging.debug(f"df.columns: {df.columns}")
-        logging.debug(f"df.shape: {df.shape}")
+        logger.debug(f"df.columns: {df.columns}")
+        logger.debug(f"df.shape: {df.shape}")
 
-        logging.info("DBIO :: get_users : end")
+        logger.info("DBIO :: get_users : end")
         return df
 
     @staticmethod
-    @st.cache
+    @st.cache(hash_funcs=RUNTIME_HASH_FUNCS)
     def get_recently_played_songs_by_user(user: str, dob: int):
-        logging.info("DBIO :: get_recently_played_songs_by_user : start")
-        logging.debug(f"user: {user}")
-        logging.debug(f"dob: {dob}")
+        logger.info("DBIO :: get_recently_played_songs_by_user : start")
+        logger.debug(f"user: {user}")
+        logger.debug(f"dob: {dob}")
 
         sql = f"""
                 SELECT sname AS song, play_ts AS played_at
@@ -129,22 +186,22 @@ class DBIO:
                 ORDER BY play_ts DESC
                 LIMIT 5;
         """
-        logging.debug(sql)
+        logger.debug(sql)
 
-        df = DBHelper.query_db(sql)
+        df = DBHelper.query_db(sql, query_class="lookup")
 
-        logging.debug(f"df.columns: {df.columns}")
-        logging.debug(f"df.shape: {df.shape}")
+        logger.debug(f"df.columns: {df.columns}")
+        logger.debug(f"df.shape: {df.shape}")
 
-        logging.info("DBIO :: get_recently_played_songs_by_user : end")
+        logger.info("DBIO :: get_recently_played_songs_by_user : end")
         return df
 
     @staticmethod
-    @st.cache
+    @st.cache(hash_funcs=RUNTIME_HASH_FUNCS)
     def get_most_played_songs_by_user(user: str, dob: int):
-        logging.info("DBIO :: get_most_played_songs_by_user : start")
-        logging.debug(f"user: {user}")
-        logging.debug(f"dob: {dob}")
+        logger.info("DBIO :: get_most_played_songs_by_user : start")
+        logger.debug(f"user: {user}")
+        logger.debug(f"dob: {dob}")
 
         sql = f"""
                     SELECT sname AS song, COUNT(*) AS numPlays
@@ -155,22 +212,22 @@ class DBIO:
                     ORDER BY COUNT(*) DESC
                     LIMIT 8;
             """
-        logging.debug(sql)
+        logger.debug(sql)
 
         df = DBHelper.query_db(sql)
 
-        logging.debug(f"df.columns: {df.columns}")
-        logging.debug(f"df.shape: {df.shape}")
+        logger.debug(f"df.columns: {df.columns}")
+        logger.debug(f"df.shape: {df.shape}")
 
-        logging.info("DBIO :: get_most_played_songs_by_user : end")
+        logger.info("DBIO :: get_most_played_songs_by_user : end")
         return df
 
     @staticmethod
-    @st.cache
+    @st.cache(hash_funcs=RUNTIME_HASH_FUNCS)
     def get_most_played_genres_by_user(user: str, dob: int):
-        logging.info("DBIO :: get_most_played_genres_by_user : start")
-        logging.debug(f"user: {user}")
-        logging.debug(f"dob: {dob}")
+        logger.info("DBIO :: get_most_played_genres_by_user : start")
+        logger.debug(f"user: {user}")
+        logger.debug(f"dob: {dob}")
 
         sql = f"""
                 SELECT genre, COUNT(*) AS numPlays
@@ -182,23 +239,23 @@ class DBIO:
                 ORDER BY COUNT(*) DESC
                 LIMIT 3
         """
-        logging.debug(sql)
+        logger.debug(sql)
 
         df = DBHelper.query_db(sql)
 
-        logging.debug(f"df.columns: {df.columns}")
-        logging.debug(f"df.shape: {df.shape}")
+        logger.debug(f"df.columns: {df.columns}")
+        logger.debug(f"df.shape: {df.shape}")
 
-        logging.info("DBIO :: get_most_played_genres_by_user : end")
+        logger.info("DBIO :: get_most_played_genres_by_user : end")
         return df
 
     @staticmethod
-    @st.cache
+    @st.cache(hash_funcs=RUNTIME_HASH_FUNCS)
     def get_recommended_songs_for_user(user: str, dob: int):
-        logging.info("DBIO :: get_recommended_songs_for_user : start")
+        logger.info("DBIO :: get_recommended_songs_for_user : start")
 
-        logging.debug(f"user: {user}")
-        logging.debug(f"dob: {dob}")
+        logger.debug(f"user: {user}")
+        logger.debug(f"dob: {dob}")
 
         sql = f"""
                     SELECT name AS song, genre
@@ -222,20 +279,20 @@ class DBIO:
                     ORDER BY name
                     LIMIT 10
             """
-        logging.debug(sql)
+        logger.debug(sql)
 
-        df = DBHelper.query_db(sql)
+        df = DBHelper.query_db(sql, query_class="heavy")
 
-        logging.debug(f"df.columns: {df.columns}")
-        logging.debug(f"df.shape: {df.shape}")
+        logger.debug(f"df.columns: {df.columns}")
+        logger.debug(f"df.shape: {df.shape}")
 
-        logging.info("DBIO :: get_recommended_songs_for_user : end")
+        logger.info("DBIO :: get_recommended_songs_for_user : end")
         return df
 
     @staticmethod
-    @st.cache
+    @st.cache(hash_funcs=RUNTIME_HASH_FUNCS)
     def get_songs(most_played: bool) -> pd.DataFrame:
-        logging.info("DBIO :: get_songs : start")
+        logger.info("DBIO :: get_songs : start")
 
         if most_played:
             sql = f"""
@@ -256,22 +313,22 @@ class DBIO:
                     GROUP BY S.name, S.release_date, S.genre
                     ORDER BY S.name;
             """
-        logging.debug(sql)
+        logger.debug(sql)
 
         df = DBHelper.query_db(sql=sql)
 
-        logging.debug(f"df.columns: {df.columns}")
-        logging.debug(f"df.shape: {df.shape}")
+        logger.debug(f"df.columns: {df.columns}")
+        logger.debug(f"df.shape: {df.shape}")
 
-        logging.info("DBIO :: get_songs : end")
+        logger.info("DBIO :: get_songs : end")
         return df
 
     @staticmethod
-    @st.cache
+    @st.cache(hash_funcs=RUNTIME_HASH_FUNCS)
     def get_top_listeners_of_song(song: str, release: int):
-        logging.info("DBIO :: get_top_listeners_of_song : start")
-        logging.debug(f"song: {song}")
-        logging.debug(f"release: {release}")
+        logger.info("DBIO :: get_top_listeners_of_song : start")
+        logger.debug(f"song: {song}")
+        logger.debug(f"release: {release}")
 
         sql = f"""
                 SELECT uname AS user, COUNT(*) AS numPlays
@@ -282,22 +339,22 @@ class DBIO:
                 ORDER BY COUNT(*) DESC
                 LIMIT 5
         """
-        logging.debug(sql)
+        logger.debug(sql)
 
         df = DBHelper.query_db(sql)
 
-        logging.debug(f"df.columns: {df.columns}")
-        logging.debug(f"df.shape: {df.shape}")
+        logger.debug(f"df.columns: {df.columns}")
+        logger.debug(f"df.shape: {df.shape}")
 
-        logging.info("DBIO :: get_top_listeners_of_song : end")
+        logger.info("DBIO :: get_top_listeners_of_song : end")
         return df
 
     @staticmethod
-    @st.cache
+    @st.cache(hash_funcs=RUNTIME_HASH_FUNCS)
     def get_songs_with_common_listeners(song: str, release: int):
-        logging.info("DBIO :: get_songs_with_common_listeners : start")
-        logging.debug(f"song: {song}")
-        logging.debug(f"release: {release}")
+        logger.info("DBIO :: get_songs_with_common_listeners : start")
+        logger.debug(f"song: {song}")
+        logger.debug(f"release: {release}")
 
         sql = f"""
                     SELECT SP2.sname AS song, SP2.srelease_date AS release
@@ -316,24 +373,24 @@ class DBIO:
                     ORDER BY release DESC, song
                     LIMIT 20
             """
-        logging.debug(sql)
+        logger.debug(sql)
 
-        df = DBHelper.query_db(sql)
+        df = DBHelper.query_db(sql, query_class="heavy")
 
-        logging.debug(f"df.columns: {df.columns}")
-        logging.debug(f"df.shape: {df.shape}")
+        logger.debug(f"df.columns: {df.columns}")
+        logger.debug(f"df.shape: {df.shape}")
 
-        logging.info("DBIO :: get_songs_with_common_listeners : end")
+        logger.info("DBIO :: get_songs_with_common_listeners : end")
         return df
 
     @staticmethod
-    @st.cache
+    @st.cache(hash_funcs=RUNTIME_HASH_FUNCS)
     def get_artists_with_most_song_releases(start_year, end_year, award_won):
-        logging.info("DBIO :: get_artists_with_most_song_releases : start")
+        logger.info("DBIO :: get_artists_with_most_song_releases : start")
 
-        logging.debug(f"start_year: {start_year}")
-        logging.debug(f"end_year: {end_year}")
-        logging.debug(f"award_won: {award_won}")
+        logger.debug(f"start_year: {start_year}")
+        logger.debug(f"end_year: {end_year}")
+        logger.debug(f"award_won: {award_won}")
 
         if award_won == "yes":
             sql = f"""
@@ -363,24 +420,24 @@ class DBIO:
                     ORDER BY COUNT(*) DESC, ACS.aname, ACS.adob
                     LIMIT 10
             """
-        logging.debug(sql)
+        logger.debug(sql)
 
         df = DBHelper.query_db(sql)
 
-        logging.debug(f"df.columns: {df.columns}")
-        logging.debug(f"df.shape: {df.shape}")
+        logger.debug(f"df.columns: {df.columns}")
+        logger.debug(f"df.shape: {df.shape}")
 
-        logging.info("DBIO :: get_artists_with_most_song_releases : end")
+        logger.info("DBIO :: get_artists_with_most_song_releases : end")
         return df
 
     @staticmethod
-    @st.cache
+    @st.cache(hash_funcs=RUNTIME_HASH_FUNCS)
     def get_artists_with_most_album_releases(start_year, end_year, award_won):
-        logging.info("DBIO :: get_artists_with_most_album_releases : start")
+        logger.info("DBIO :: get_artists_with_most_album_releases : start")
 
-        logging.debug(f"start_year: {start_year}")
-        logging.debug(f"end_year: {end_year}")
-        logging.debug(f"award_won: {award_won}")
+        logger.debug(f"start_year: {start_year}")
+        logger.debug(f"end_year: {end_year}")
+        logger.debug(f"award_won: {award_won}")
 
         if award_won == "yes":
             sql = f"""
@@ -410,40 +467,40 @@ class DBIO:
                     ORDER BY COUNT(*) DESC, ACA.artist_name, ACA.artist_dob
                     LIMIT 10
             """
-        logging.debug(sql)
+        logger.debug(sql)
 
         df = DBHelper.query_db(sql)
 
-        logging.debug(f"df.columns: {df.columns}")
-        logging.debug(f"df.shape: {df.shape}")
+        logger.debug(f"df.columns: {df.columns}")
+        logger.debug(f"df.shape: {df.shape}")
 
-        logging.info("DBIO :: get_artists_with_most_album_releases : end")
+        logger.info("DBIO :: get_artists_with_most_album_releases : end")
         return df
 
     @staticmethod
-    @st.cache
+    @st.cache(hash_funcs=RUNTIME_HASH_FUNCS)
     def get_artists_in_bands():
-        logging.info("DBIO :: get_artists_in_bands : start")
+        logger.info("DBIO :: get_artists_in_bands : start")
 
         sql = f"""
                 SELECT AFB.aname AS artist, AFB.bname AS band
                 FROM {DBIO.ArtistsFormBands} AFB
         """
 
-        logging.debug(sql)
+        logger.debug(sql)
 
-        df = DBHelper.query_db(sql)
+        df = DBHelper.query_db(sql, query_class="lookup")
 
-        logging.debug(f"df.columns: {df.columns}")
-        logging.debug(f"df.shape: {df.shape}")
+        logger.debug(f"df.columns: {df.columns}")
+        logger.debug(f"df.shape: {df.shape}")
 
-        logging.info("DBIO :: get_artists_in_bands : end")
+        logger.info("DBIO :: get_artists_in_bands : end")
         return df
 
     @staticmethod
-    @st.cache
+    @st.cache(hash_funcs=RUNTIME_HASH_FUNCS)
     def get_bands(most_albums: bool) -> pd.DataFrame:
-        logging.info("DBIO :: get_bands : start")
+        logger.info("DBIO :: get_bands : start")
 
         if most_albums:
             sql = f"""
@@ -458,94 +515,126 @@ class DBIO:
                     SELECT name AS band, since AS since
                     FROM {DBIO.Bands}
             """
-        logging.debug(sql)
+        logger.debug(sql)
 
         df = DBHelper.query_db(sql=sql)
 
-        logging.debug(f"df.columns: {df.columns}")
-        logging.debug(f"df.shape: {df.shape}")
+        logger.debug(f"df.columns: {df.columns}")
+        logger.debug(f"df.shape: {df.shape}")
 
-        logging.info("DBIO :: get_bands : end")
+        logger.info("DBIO :: get_bands : end")
         return df
 
     @staticmethod
-    @st.cache
+    @st.cache(hash_funcs=RUNTIME_HASH_FUNCS)
     def get_genres():
-        logging.info("get_genres : start")
+        logger.info("get_genres : start")
 
         sql = f"""
                 SELECT DISTINCT genre AS genre
                 FROM {DBIO.Songs}
         """
-        logging.debug(sql)
+        logger.debug(sql)
 
-        df = DBHelper.query_db(sql=sql)
+        df = DBHelper.query_db(sql=sql, query_class="lookup")
 
-        logging.debug(f"df.columns: {df.columns}")
-        logging.debug(f"df.shape: {df.shape}")
+        logger.debug(f"df.columns: {df.columns}")
+        logger.debug(f"df.shape: {df.shape}")
 
-        logging.info("get_genres : end")
+        logger.info("get_genres : end")
         return df
 
     @staticmethod
-    @st.cache
-    def get_bands_with_most_song_plays(year: int, genre: str):
-        logging.info("get_bands_with_most_song_plays : start")
+    @st.cache(hash_funcs=RUNTIME_HASH_FUNCS)
+    def get_bands_with_most_song_plays(year: int, genre: str, month: int = None):
+        logger.info("get_bands_with_most_song_plays : start")
+        logger.debug(f"month: {month}")
 
+        # served from the play count cube; without a month the year is rolled up over its months
+        month_filter = "AND C.month = %(month)s" if month else ""
         sql = f"""
-                SELECT BCS.bname AS band, BCS.bsince AS since, COUNT(*) AS numHits
-                FROM {DBIO.Songs} S, {DBIO.SongPlays} SP, {DBIO.BandsCreateSongs} BCS
-                WHERE BCS.sname = S.name
-                AND BCS.srelease_date = S.release_date
-                AND SP.sname = S.name
-                AND SP.srelease_date = S.release_date
-                AND S.genre = '{genre}'
-                AND SP.play_ts > {year}0000000000
-                AND SP.play_ts < {year + 1}0000000000
-                GROUP BY BCS.bname, BCS.bsince
-                ORDER BY COUNT(*) DESC, BCS.bname, BCS.bsince;
+                SELECT C.bname AS band, C.bsince AS since, SUM(C.plays) AS numHits
+                FROM {DBIO.BandPlaysCube} C
+                WHERE C.genre = %(genre)s
+                AND C.year = %(year)s
+                {month_filter}
+                GROUP BY C.bname, C.bsince
+                ORDER BY SUM(C.plays) DESC, C.bname, C.bsince;
         """
 
-        logging.debug(sql)
+        logger.debug(sql)
 
-        df = DBHelper.query_db(sql=sql)
+        df = DBHelper.query_db(sql=sql, query_class="lookup",
+                               params={"genre": genre, "year": year, "month": month})
 
-        logging.debug(f"df.columns: {df.columns}")
-        logging.debug(f"df.shape: {df.shape}")
+        logger.debug(f"df.columns: {df.columns}")
+        logger.debug(f"df.shape: {df.shape}")
 
-        logging.info("get_bands_with_most_song_plays : end")
+        logger.info("get_bands_with_most_song_plays : end")
         return df
 
     @staticmethod
-    @st.cache
+    @st.cache(hash_funcs=RUNTIME_HASH_FUNCS)
+    def get_band_plays_by_genre_and_year(genres: tuple, years: tuple):
+        logger.info("get_band_plays_by_genre_and_year : start")
+        logger.debug(f"genres: {genres}")
+        logger.debug(f"years: {years}")
+
+        sql = f"""
+                SELECT C.genre AS genre, C.year AS year, C.bname AS band, C.bsince AS since,
+                    SUM(C.plays) AS numHits
+                FROM {DBIO.BandPlaysCube} C
+                WHERE C.genre = ANY(%s)
+                AND C.year = ANY(%s)
+                GROUP BY C.genre, C.year, C.bname, C.bsince
+                ORDER BY C.genre, C.year, SUM(C.plays) DESC, C.bname, C.bsince;
+        """
+
+        logger.debug(sql)
+
+        df = DBHelper.query_db(sql=sql, query_class="lookup", params=(list(genres), list(years)))
+
+        logger.debug(f"df.columns: {df.columns}")
+        logger.debug(f"df.shape: {df.shape}")
+
+        logger.info("get_band_plays_by_genre_and_year : end")
+        return df
+
+    @staticmethod
+    @st.cache(hash_funcs=RUNTIME_HASH_FUNCS)
     def get_albums_most_featured_in_user_libraries(year: int, genre: str):
-        logging.info("get_albums_most_featured_in_user_libraries : start")
+        logger.info("get_albums_most_featured_in_user_libraries : start")
 
+        # served from the library adds cube, rolled up over every year since the given one
         sql = f"""
-                SELECT ALS.aname AS album, ALS.arelease_date AS release, COUNT(*) AS timesAdded
-                FROM {DBIO.Songs} S, {DBIO.AlbumsListSongs} ALS, {DBIO.UserLibraries} UL
-                WHERE UL.sname = ALS.sname
-                AND UL.srelease_date = ALS.srelease_date
-                AND UL.sname = S.name
-                AND UL.srelease_date = S.release_date
-                AND UL.since > {year}0000
-                AND S.genre = '{genre}'
-                GROUP BY ALS.aname, ALS.arelease_date
-                ORDER BY COUNT(*) DESC, ALS.aname, ALS.arelease_date DESC
+                SELECT C.aname AS album, C.arelease_date AS release, SUM(C.adds) AS timesAdded
+                FROM {DBIO.AlbumAddsCube} C
+                WHERE C.genre = %(genre)s
+                AND C.year >= %(year)s
+                GROUP BY C.aname, C.arelease_date
+                ORDER BY SUM(C.adds) DESC, C.aname, C.arelease_date DESC
         """
 
-        logging.debug(sql)
+        logger.debug(sql)
 
-        df = DBHelper.query_db(sql=sql)
+        df = DBHelper.query_db(sql=sql, query_class="lookup", params={"genre": genre, "year": year})
 
-        logging.debug(f"df.columns: {df.columns}")
-        logging.debug(f"df.shape: {df.shape}")
+        logger.debug(f"df.columns: {df.columns}")
+        logger.debug(f"df.shape: {df.shape}")
 
-        logging.info("get_albums_most_featured_in_user_libraries : end")
+        logger.info("get_albums_most_featured_in_user_libraries : end")
         return df
 
 
 def run():
+    try:
+        render()
+    except QueryRejected as e:
+        # raised instead of returning a partial result, so nothing gets cached
+        st.error(f"{QueryRejected.marker}{e}")
+
+
+def render():
     # Title of the App
     st.title("Music Wrapped!")
 
@@ -720,13 +809,31 @@ def run():
         # the app, therefore hard-coding values here
         year = st.selectbox("year", [2017, 2018, 2019, 2020])
         year = int(year)
-        most_plays_df = DBIO.get_bands_with_most_song_plays(year=year, genre=genre)
+        # drill down from the whole year to a single month
+        month = st.selectbox("month", ["all"] + [i + 1 for i in range(12)])
+        month = None if month == "all" else int(month)
+        most_plays_df = DBIO.get_bands_with_most_song_plays(year=year, genre=genre, month=month)
         if most_plays_df.shape[0] == 0:
             st.write("No bands meet the given criteria!")
         else:
-            st.subheader(f"Most played '{genre}' songs in year {year} belonged to the following bands:")
+            period = f"year {year}" if month is None else f"month {month} of {year}"
+            st.subheader(f"Most played '{genre}' songs in {period} belonged to the following bands:")
             st.write(most_plays_df)
 
+        # =============================================================================================
+        # Band song plays across several genres and years
+        # =============================================================================================
+        st.subheader("Compare the most hit bands across genres and years:")
+        cmp_genres = st.multiselect("Genres", genres_list, default=[genre])
+        cmp_years = st.multiselect("Years", [2017, 2018, 2019, 2020], default=[year])
+        if cmp_genres and cmp_years:
+            cmp_df = DBIO.get_band_plays_by_genre_and_year(genres=tuple(cmp_genres),
+                                                           years=tuple(int(y) for y in cmp_years))
+            if cmp_df.shape[0] == 0:
+                st.write("No bands meet the given criteria!")
+            else:
+                st.write(cmp_df)
+
     # Display code for Albums
     elif area == DBIO.Albums:
         st.subheader(DBIO.Albums)
@@ -750,4 +857,5 @@ def run():
             st.write(albums_df)
 
 
-run()
+if __name__ == "__main__":
+    run()
@@ -136,4 +136,156 @@ create table Users_Libraries(
         primary key(uname, udob, lib_name, sname, srelease_date),
         foreign key (uname, udob) references Users(name, dob) on delete cascade,
         foreign key (sname, srelease_date) references Songs(name, release_date)
-);
\ No newline at end of file
+);
+
+--###################################################################################################
+-- OLAP CUBES
+-- play counts by (genre, year, month, band) and library adds by (genre, year, month, album), kept
+-- up to date by the triggers below; year-level views roll the month level up with SUM().
+-- Changes to Songs.genre, Bands_Create_Songs or Albums_List_Songs are not tracked incrementally:
+-- refresh_music_cubes() is the only way to sync them, and load.sql calls it once all data is in.
+--###################################################################################################
+
+drop table if exists Band_Plays_Cube, Album_Adds_Cube cascade;
+
+create table Band_Plays_Cube(
+        genre varchar(128),
+        year smallint,
+        month smallint,
+        bname varchar(128),
+        bsince smallint,
+        plays integer not null,
+        primary key(genre, year, month, bname, bsince)
+);
+
+create table Album_Adds_Cube(
+        genre varchar(128),
+        year smallint,
+        month smallint,
+        aname varchar(128),
+        arelease_date smallint,
+        adds integer not null,
+        primary key(genre, year, month, aname, arelease_date)
+);
+
+-- play_ts is YYYYMMDDhhmmss, Users_Libraries.since is YYYYMMDD
+create or replace function refresh_music_cubes() returns void as $$
+begin
+        delete from Band_Plays_Cube;
+        insert into Band_Plays_Cube(genre, year, month, bname, bsince, plays)
+        select S.genre, SP.play_ts / 10000000000, SP.play_ts / 100000000 % 100, BCS.bname, BCS.bsince, count(*)
+        from Songs S, Song_Plays SP, Bands_Create_Songs BCS
+        where BCS.sname = S.name
+        and BCS.srelease_date = S.release_date
+        and SP.sname = S.name
+        and SP.srelease_date = S.release_date
+        group by 1, 2, 3, 4, 5;
+
+        delete from Album_Adds_Cube;
+        insert into Album_Adds_Cube(genre, year, month, aname, arelease_date, adds)
+        select S.genre, UL.since / 10000, UL.since / 100 % 100, ALS.aname, ALS.arelease_date, count(*)
+        from Songs S, Albums_List_Songs ALS, Users_Libraries UL
+        where UL.sname = ALS.sname
+        and UL.srelease_date = ALS.srelease_date
+        and UL.sname = S.name
+        and UL.srelease_date = S.release_date
+        group by 1, 2, 3, 4, 5;
+end;
+$$ language plpgsql;
+
+create or replace function band_plays_cube_apply() returns trigger as $$
+begin
+        if TG_OP in ('DELETE', 'UPDATE') then
+                update Band_Plays_Cube C
+                set plays = C.plays - D.plays
+                from (
+                        select S.genre, SP.play_ts / 10000000000 as year, SP.play_ts / 100000000 % 100 as month,
+                               BCS.bname, BCS.bsince, count(*) as plays
+                        from old_plays SP, Songs S, Bands_Create_Songs BCS
+                        where BCS.sname = S.name
+                        and BCS.srelease_date = S.release_date
+                        and SP.sname = S.name
+                        and SP.srelease_date = S.release_date
+                        group by 1, 2, 3, 4, 5
+                ) D
+                where C.genre = D.genre and C.year = D.year and C.month = D.month
+                and C.bname = D.bname and C.bsince = D.bsince;
+
+                delete from Band_Plays_Cube where plays <= 0;
+        end if;
+
+        if TG_OP in ('INSERT', 'UPDATE') then
+                insert into Band_Plays_Cube(genre, year, month, bname, bsince, plays)
+                select S.genre, SP.play_ts / 10000000000, SP.play_ts / 100000000 % 100, BCS.bname, BCS.bsince, count(*)
+                from new_plays SP, Songs S, Bands_Create_Songs BCS
+                where BCS.sname = S.name
+                and BCS.srelease_date = S.release_date
+                and SP.sname = S.name
+                and SP.srelease_date = S.release_date
+                group by 1, 2, 3, 4, 5
+                on conflict (genre, year, month, bname, bsince)
+                do update set plays = Band_Plays_Cube.plays + excluded.plays;
+        end if;
+
+        return null;
+end;
+$$ language plpgsql;
+
+create or replace function album_adds_cube_apply() returns trigger as $$
+begin
+        if TG_OP in ('DELETE', 'UPDATE') then
+                update Album_Adds_Cube C
+                set adds = C.adds - D.adds
+                from (
+                        select S.genre, UL.since / 10000 as year, UL.since / 100 % 100 as month,
+                               ALS.aname, ALS.arelease_date, count(*) as adds
+                        from old_adds UL, Songs S, Albums_List_Songs ALS
+                        where UL.sname = ALS.sname
+                        and UL.srelease_date = ALS.srelease_date
+                        and UL.sname = S.name
+                        and UL.srelease_date = S.release_date
+                        group by 1, 2, 3, 4, 5
+                ) D
+                where C.genre = D.genre and C.year = D.year and C.month = D.month
+                and C.aname = D.aname and C.arelease_date = D.arelease_date;
+
+                delete from Album_Adds_Cube where adds <= 0;
+        end if;
+
+        if TG_OP in ('INSERT', 'UPDATE') then
+                insert into Album_Adds_Cube(genre, year, month, aname, arelease_date, adds)
+                select S.genre, UL.since / 10000, UL.since / 100 % 100, ALS.aname, ALS.arelease_date, count(*)
+                from new_adds UL, Songs S, Albums_List_Songs ALS
+                where UL.sname = ALS.sname
+                and UL.srelease_date = ALS.srelease_date
+                and UL.sname = S.name
+                and UL.srelease_date = S.release_date
+                group by 1, 2, 3, 4, 5
+                on conflict (genre, year, month, aname, arelease_date)
+                do update set adds = Album_Adds_Cube.adds + excluded.adds;
+        end if;
+
+        return null;
+end;
+$$ language plpgsql;
+
+-- transition tables only allow one event per trigger, hence three triggers per base table
+create trigger band_plays_cube_insert after insert on Song_Plays
+        referencing new table as new_plays
+        for each statement execute procedure band_plays_cube_apply();
+create trigger band_plays_cube_update after update on Song_Plays
+        referencing old table as old_plays new table as new_plays
+        for each statement execute procedure band_plays_cube_apply();
+create trigger band_plays_cube_delete after delete on Song_Plays
+        referencing old table as old_plays
+        for each statement execute procedure band_plays_cube_apply();
+
+create trigger album_adds_cube_insert after insert on Users_Libraries
+        referencing new table as new_adds
+        for each statement execute procedure album_adds_cube_apply();
+create trigger album_adds_cube_update after update on Users_Libraries
+        referencing old table as old_adds new table as new_adds
+        for each statement execute procedure album_adds_cube_apply();
+create trigger album_adds_cube_delete after delete on Users_Libraries
+        referencing old table as old_adds
+        for each statement execute procedure album_adds_cube_apply();
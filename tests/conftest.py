@@ -0,0 +1,50 @@
+import os
+import sys
+import uuid
+
+import psycopg2
+import psycopg2.pool
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# importing db_runtime must not connect to whatever database.ini points at; the database tests
+# bring their own pool (see the `pool` fixture)
+os.environ.setdefault("MUSIC_WRAPPED_CONFIG", os.path.join(ROOT, "tests", "no-database.ini"))
+
+# e.g. MUSIC_WRAPPED_TEST_DSN="host=localhost dbname=postgres user=postgres password=postgres"
+TEST_DSN = os.environ.get("MUSIC_WRAPPED_TEST_DSN")
+
+
+def _db_reachable() -> bool:
+    if not TEST_DSN:
+        return False
+    try:
+        psycopg2.connect(TEST_DSN).close()
+    except psycopg2.Error:
+        return False
+    return True
+
+
+requires_db = pytest.mark.skipif(not _db_reachable(), reason="no Postgres at MUSIC_WRAPPED_TEST_DSN")
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    import db_runtime
+
+    pool = psycopg2.pool.ThreadedConnectionPool(1, 8, dsn=TEST_DSN)
+    monkeypatch.setattr(db_runtime.POOLS, "primary", pool)
+    monkeypatch.setattr(db_runtime.POOLS, "replica", None)
+    yield pool
+    pool.closeall()
+
+
+@pytest.fixture
+def unique_sql():
+    # query_db is st.cache'd on its sql, so every query a test runs gets a unique comment
+    def make(sql: str) -> str:
+        return f"{sql} -- {uuid.uuid4()}"
+
+    return make
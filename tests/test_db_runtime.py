@@ -0,0 +1,125 @@
+import os
+import threading
+import time
+from types import SimpleNamespace
+
+import psycopg2.extensions
+import psycopg2.pool
+import pytest
+
+import db_runtime
+from db_runtime import ConnectionPools, QueryRejected, Settings, WeightedSemaphore, _run_interrupted
+
+
+def test_semaphore_admits_within_capacity():
+    sem = WeightedSemaphore(4)
+    assert sem.acquire(1, timeout=0)
+    assert sem.acquire(3, timeout=0)
+    assert sem.in_use == 4
+    assert not sem.acquire(1, timeout=0)
+
+    sem.release(3)
+    assert sem.acquire(2, timeout=0)
+    assert sem.in_use == 3
+
+
+def test_semaphore_caps_oversized_weight_at_capacity():
+    sem = WeightedSemaphore(4)
+    assert sem.acquire(10, timeout=0)
+    assert sem.in_use == 4
+    sem.release(10)
+    assert sem.in_use == 0
+
+
+def test_semaphore_queues_until_released():
+    sem = WeightedSemaphore(2)
+    assert sem.acquire(2, timeout=0)
+
+    threading.Timer(0.1, sem.release, args=(2,)).start()
+    start = time.monotonic()
+    assert sem.acquire(1, timeout=2)
+    assert 0.05 < time.monotonic() - start < 1.5
+
+
+def test_semaphore_sheds_after_timeout():
+    sem = WeightedSemaphore(2)
+    assert sem.acquire(2, timeout=0)
+
+    start = time.monotonic()
+    assert not sem.acquire(1, timeout=0.1)
+    assert time.monotonic() - start >= 0.1
+    assert sem.in_use == 2
+
+
+def _ctx(state_name):
+    return SimpleNamespace(script_requests=SimpleNamespace(_state=SimpleNamespace(name=state_name)))
+
+
+def test_run_interrupted():
+    assert not _run_interrupted(None)
+    assert not _run_interrupted(SimpleNamespace())
+    assert not _run_interrupted(_ctx("CONTINUE"))
+    assert _run_interrupted(_ctx("RERUN"))
+    assert _run_interrupted(_ctx("STOP"))
+
+
+class FakeConnection:
+    """Reports POLL_READ a few times before the statement completes and counts cancels."""
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.polls = 0
+        self.cancels = 0
+
+    def poll(self):
+        self.polls += 1
+        return psycopg2.extensions.POLL_OK if self.polls % 3 == 0 else psycopg2.extensions.POLL_READ
+
+    def fileno(self):
+        return self.fd
+
+    def cancel(self):
+        self.cancels += 1
+
+
+def test_wait_callback_cancels_once_per_query(monkeypatch):
+    monkeypatch.setattr(db_runtime, "_run_interrupted", lambda ctx: True)
+    monkeypatch.setattr(db_runtime, "CancelCheckInterval", 0)
+    read_fd, write_fd = os.pipe()
+    try:
+        conn = FakeConnection(read_fd)
+        db_runtime.clear_interrupted()
+        db_runtime._wait_interruptible(conn)  # the query
+        db_runtime._wait_interruptible(conn)  # the ROLLBACK after QueryCanceledError
+        assert conn.cancels == 1
+        assert db_runtime.was_interrupted()
+
+        db_runtime.clear_interrupted()
+        db_runtime._wait_interruptible(conn)  # the next query
+        assert conn.cancels == 2
+    finally:
+        os.close(read_fd)
+        os.close(write_fd)
+        db_runtime.clear_interrupted()
+
+
+def test_unreachable_database_is_retried_on_first_use(monkeypatch):
+    # nothing listens on port 1, so connecting fails straight away
+    settings = Settings(db={"host": "127.0.0.1", "port": "1", "dbname": "music", "connect_timeout": "1"},
+                        replica=None)
+    pools = ConnectionPools(settings)
+    assert pools.primary is None
+    assert pools.pools() == []
+
+    with pytest.raises(QueryRejected, match="unavailable"):
+        pools.get(read_only=False)
+
+    monkeypatch.setattr(psycopg2.pool, "ThreadedConnectionPool", lambda *args, **kwargs: "pool")
+    assert pools.get(read_only=True) == "pool"
+    assert pools.pools() == ["pool"]
+
+
+def test_no_database_configured():
+    pools = ConnectionPools(Settings(db=None, replica=None))
+    with pytest.raises(QueryRejected, match="No database configured"):
+        pools.get(read_only=False)
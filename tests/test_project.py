@@ -0,0 +1,129 @@
+import os
+import threading
+import time
+from collections import namedtuple
+
+import pandas as pd
+import pytest
+
+import db_runtime
+import project
+from conftest import ROOT, requires_db
+from db_runtime import QueryRejected, WeightedSemaphore
+from project import DBHelper
+
+Column = namedtuple("Column", ["name", "type_code"])
+INT2, INT4, INT8, VARCHAR = 21, 23, 20, 1043
+
+
+def test_build_frame_compacts_columns():
+    data = [("Rock", "a", 1995, 120), ("Rock", "b", 2004, 7), ("Pop", "c", 2009, 3), ("Pop", "d", 2011, 1)]
+    description = [Column("genre", VARCHAR), Column("song", VARCHAR), Column("release", INT2),
+                   Column("numplays", INT8)]
+
+    df = DBHelper.build_frame(data=data, description=description)
+
+    assert list(df.columns) == ["genre", "song", "release", "numplays"]
+    assert isinstance(df["genre"].dtype, pd.CategoricalDtype)
+    assert df["song"].dtype == object
+    assert df["release"].dtype == "int16"
+    assert df["numplays"].dtype == "int8"
+    assert df["genre"].tolist() == ["Rock", "Rock", "Pop", "Pop"]
+    assert df["numplays"].tolist() == [120, 7, 3, 1]
+
+
+def test_build_frame_keeps_nulls_in_int_columns():
+    df = DBHelper.build_frame(data=[(1,), (None,)], description=[Column("dob", INT4)])
+    assert df["dob"].dtype.kind == "f"
+    assert df["dob"].isna().tolist() == [False, True]
+
+
+def test_build_frame_empty_result_keeps_columns():
+    df = DBHelper.build_frame(data=[], description=[Column("band", VARCHAR), Column("since", INT2)])
+    assert list(df.columns) == ["band", "since"]
+    assert df.shape[0] == 0
+
+
+@pytest.fixture
+def admission(monkeypatch):
+    sem = WeightedSemaphore(4)
+    monkeypatch.setattr(project, "ADMISSION", sem)
+    return sem
+
+
+@pytest.fixture
+def query_classes(monkeypatch):
+    classes = {
+        "fast": (300, 1, 0.1, False),
+        "slow": (5000, 1, 0.1, False),
+        "heavy": (5000, 4, 0.1, False),
+    }
+    monkeypatch.setattr(DBHelper, "QueryClasses", classes)
+    return classes
+
+
+def test_query_is_shed_when_capacity_is_full(admission, query_classes, unique_sql, monkeypatch):
+    # a shed query never borrows a connection
+    monkeypatch.setattr(db_runtime.POOLS, "primary", object())
+    assert admission.acquire(4, timeout=0)
+
+    with pytest.raises(QueryRejected, match="busy"):
+        DBHelper.query_db(unique_sql("SELECT 1"), query_class="fast")
+    # a shed query must not give back weight it never took
+    assert admission.in_use == 4
+
+
+@requires_db
+def test_statement_timeout_per_query_class(pool, admission, query_classes, unique_sql):
+    start = time.monotonic()
+    with pytest.raises(QueryRejected, match="budget"):
+        DBHelper.query_db(unique_sql("SELECT pg_sleep(3)"), query_class="fast")
+    assert time.monotonic() - start < 2
+
+    df = DBHelper.query_db(unique_sql("SELECT 42 AS answer, pg_sleep(0.5)"), query_class="slow")
+    assert df["answer"].tolist() == [42]
+    assert admission.in_use == 0
+
+
+@requires_db
+def test_query_is_cancelled_when_run_is_interrupted(pool, admission, query_classes, unique_sql, monkeypatch):
+    interrupt_at = time.monotonic() + 0.3
+    monkeypatch.setattr(db_runtime, "_run_interrupted", lambda ctx: time.monotonic() > interrupt_at)
+
+    start = time.monotonic()
+    with pytest.raises(QueryRejected, match="rerun or closed"):
+        DBHelper.query_db(unique_sql("SELECT pg_sleep(3)"), query_class="slow")
+    assert time.monotonic() - start < 2
+    assert admission.in_use == 0
+
+    # the connection went back to the pool in a usable state
+    monkeypatch.setattr(db_runtime, "_run_interrupted", lambda ctx: False)
+    assert DBHelper.query_db(unique_sql("SELECT 1 AS one"), query_class="slow")["one"].tolist() == [1]
+
+
+@requires_db
+def test_heavy_query_sheds_concurrent_work(pool, admission, query_classes, unique_sql):
+    heavy = threading.Thread(target=DBHelper.query_db, args=(unique_sql("SELECT pg_sleep(1)"), "heavy"))
+    heavy.start()
+    deadline = time.monotonic() + 2
+    while admission.in_use < 4 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert admission.in_use == 4
+
+    with pytest.raises(QueryRejected, match="busy"):
+        DBHelper.query_db(unique_sql("SELECT 1"), query_class="fast")
+
+    heavy.join()
+    assert admission.in_use == 0
+    assert DBHelper.query_db(unique_sql("SELECT 1 AS one"), query_class="fast")["one"].tolist() == [1]
+
+
+def test_app_renders_without_database():
+    testing = pytest.importorskip("streamlit.testing.v1")
+
+    # the st.cache'd DBIO methods hash their way into db_runtime; that must not raise, and a
+    # missing database is reported to the user instead
+    at = testing.AppTest.from_file(os.path.join(ROOT, "project.py"), default_timeout=30).run()
+
+    assert not at.exception
+    assert at.error[0].value.startswith(QueryRejected.marker + "No database configured")